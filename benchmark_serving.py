@@ -22,13 +22,17 @@ It currently supports TGI, vLLM, Triton TensorRT-LLM and Saxml.
 
 import argparse
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+import functools
+import hashlib
 import json
-import random
-import requests
+import os
+import sys
 import time
-from typing import AsyncGenerator, List, Optional, Tuple, Dict
-from prometheus_client import start_http_server, Histogram, Gauge, Counter
+from typing import AsyncGenerator, Callable, List, Optional, Tuple, Dict
+from prometheus_client import start_http_server, Histogram, Counter
 import logging
 
 import google.auth
@@ -37,72 +41,198 @@ from google.cloud import storage
 
 import aiohttp
 import numpy as np
+import orjson
+try:
+  import numexpr
+except ImportError:
+  numexpr = None
 from transformers import AutoTokenizer
+from transformers import PreTrainedTokenizerFast
 from transformers import PreTrainedTokenizerBase
 
 from google.protobuf.timestamp_pb2 import Timestamp
 
 MIN_SEQ_LEN = 4
+TOKENIZE_CHUNK_SIZE = 1024
 NEW_TEXT_KEY = "\nOutput:\n"
 PROMETHEUS_PORT = 9090
+REQUEST_HEADERS = {
+    "User-Agent": "Benchmark Client",
+    "Content-Type": "application/json",
+}
+
+logger = logging.getLogger(__name__)
+
+class RateLimitFilter(logging.Filter):
+  """Drops warnings repeating the same message within a time window.
+
+  Messages are told apart by their format string, so a storm of failing
+  requests logs each error type at most once per window.
+  """
+
+  def __init__(self, window_sec: float = 1.0):
+    super().__init__()
+    self._window_sec = window_sec
+    self._last_logged_sec: Dict[str, float] = {}
+
+  def filter(self, record: logging.LogRecord) -> bool:
+    if record.levelno < logging.WARNING:
+      return True
+    now_sec = time.monotonic()
+    last_logged_sec = self._last_logged_sec.get(record.msg)
+    if last_logged_sec is not None and now_sec - last_logged_sec < self._window_sec:
+      return False
+    self._last_logged_sec[record.msg] = now_sec
+    return True
+
+# Logs failed requests, which are also counted in the errors of the results.
+request_logger = logging.getLogger(f"{__name__}.requests")
+request_logger.addFilter(RateLimitFilter())
 
 # Prometheus Metrics
-prompt_length_metric = Histogram("LatencyProfileGenerator:prompt_length", "Input prompt length", buckets=[2**i for i in range(1, 16)])
-response_length_metric = Histogram("LatencyProfileGenerator:response_length", "Response length", buckets=[2**i for i in range(1, 16)])
-normalized_time_per_output_token_metric = Histogram('LatencyProfileGenerator:normalized_time_per_output_token_ms', 'Request time over total number of tokens (including first token) (ms)', buckets=[2**i for i in range(1, 16)])
-tpot_metric = Histogram('LatencyProfileGenerator:time_per_output_token_ms', 'Time per output token per request (excluding first token) (ms)', buckets=[2**i for i in range(1, 16)])
-ttft_metric = Histogram('LatencyProfileGenerator:time_to_first_token_ms', 'Time to first token per request (ms)', buckets=[2**i for i in range(1, 16)])
-active_requests_metric = Gauge('LatencyProfileGenerator:active_requests', 'How many requests actively being processed')
+# Log-spaced buckets from 1 to 60000, shared by all histograms. Dense enough to
+# resolve TTFTs of a few milliseconds as well as minute-long requests.
+HISTOGRAM_BUCKETS = tuple(float(bucket) for bucket in np.geomspace(1.0, 60000.0, 40))
+prompt_length_metric = Histogram("LatencyProfileGenerator:prompt_length", "Input prompt length", buckets=HISTOGRAM_BUCKETS)
+response_length_metric = Histogram("LatencyProfileGenerator:response_length", "Response length", buckets=HISTOGRAM_BUCKETS)
+normalized_time_per_output_token_metric = Histogram('LatencyProfileGenerator:normalized_time_per_output_token_ms', 'Request time over total number of tokens (including first token) (ms)', buckets=HISTOGRAM_BUCKETS)
+tpot_metric = Histogram('LatencyProfileGenerator:time_per_output_token_ms', 'Time per output token per request (excluding first token) (ms)', buckets=HISTOGRAM_BUCKETS)
+ttft_metric = Histogram('LatencyProfileGenerator:time_to_first_token_ms', 'Time to first token per request (ms)', buckets=HISTOGRAM_BUCKETS)
 total_request_count = Counter('LatencyProfileGenerator:request_count', 'How many total requests have been sent')
+retried_request_count = Counter('LatencyProfileGenerator:retried_request_count', 'How many requests have been re-sent after an error response')
 
-# Singleton class to track requests for QPS counting and calculation.
-class AsyncRequestCounter:
-  _instance = None
-  _lock = asyncio.Lock()
-
-  async def __new__(cls, target_requests=None, *args, **kwargs):
-    async with cls._lock:
-      if not cls._instance:
-        cls._instance = super().__new__(cls)
-        cls._instance._count = 0
-        cls._instance._start_time = time.time()
-        cls._instance._target_requests = target_requests
-    return cls._instance
-  
-  async def increment(self):
-    async with self._lock:
-      self._count += 1
-      if self._count == self._target_requests:
-        self._end_time = time.time()
-  
-  async def get_qps(self):
+# Tracks requests for QPS counting and calculation. All requests are sent from
+# a single event loop, so the counter needs no locking.
+class RequestCounter:
+
+  def __init__(self, target_requests: int):
+    self._count = 0
+    self._start_time = time.perf_counter()
+    self._end_time = None
+    self._target_requests = target_requests
+
+  def increment(self):
+    self._count += 1
+    if self._count == self._target_requests:
+      self._end_time = time.perf_counter()
+
+  def get_qps(self):
     return self._count / (self._end_time - self._start_time)
 
+# Created once per benchmark run
+request_counter: Optional[RequestCounter] = None
+
 
 # Add trace config for monitoring in flight requests
 async def on_request_start(session, trace_config_ctx, params):
-    active_requests_metric.inc()
     total_request_count.inc()
-    counter = await AsyncRequestCounter()
-    await counter.increment()
-
-async def on_request_end(session, trace_config_ctx, params):
-    active_requests_metric.dec()
 
 trace_config = aiohttp.TraceConfig()
 trace_config.on_request_start.append(on_request_start)
-trace_config.on_request_end.append(on_request_end)
+
+# Buffers the per-request values of the Prometheus histograms, which are only
+# observed once the benchmark is done to keep metric locks off the request path.
+@dataclass
+class MetricObservations:
+  ttfts: List[float] = field(default_factory=list)
+  tpots: List[float] = field(default_factory=list)
+  normalized_tpots: List[float] = field(default_factory=list)
+  prompt_lens: List[int] = field(default_factory=list)
+  response_lens: List[int] = field(default_factory=list)
+
+  def observe(self):
+    for ttft in self.ttfts:
+      ttft_metric.observe(ttft)
+    for tpot in self.tpots:
+      tpot_metric.observe(tpot)
+    for normalized_tpot in self.normalized_tpots:
+      normalized_time_per_output_token_metric.observe(normalized_tpot)
+    for prompt_len in self.prompt_lens:
+      prompt_length_metric.observe(prompt_len)
+    for response_len in self.response_lens:
+      response_length_metric.observe(response_len)
+
+# Created once per benchmark run
+metric_observations: Optional[MetricObservations] = None
 
 # Google Cloud Storage Client
 gcs_client = None
 gcs_bucket = None
 
+# Tokenizer of a tokenization worker process
+worker_tokenizer: Optional[PreTrainedTokenizerBase] = None
+
+def init_tokenize_worker(tokenizer: PreTrainedTokenizerBase):
+  global worker_tokenizer
+  worker_tokenizer = tokenizer
+
+def get_slow_token_lens(
+    texts: List[str],
+    tokenizer: Optional[PreTrainedTokenizerBase] = None,
+) -> List[int]:
+  """Returns the token counts of texts by calling the tokenizer."""
+  tokenizer = tokenizer or worker_tokenizer
+  return [
+      len(token_ids)
+      for token_ids in tokenizer(texts, return_attention_mask=False).input_ids
+  ]
+
+def get_token_lens(
+    tokenizer: PreTrainedTokenizerBase,
+    texts: List[str],
+) -> List[int]:
+  """Returns the number of tokens in each text, including special tokens."""
+  if tokenizer.is_fast:
+    backend_tokenizer = tokenizer.backend_tokenizer
+    if backend_tokenizer.truncation is None and backend_tokenizer.padding is None:
+      # Encode the whole batch in the Rust tokenizer, which spreads it across
+      # all cores, and only read the lengths, skipping the python-side
+      # conversion of ids and attention masks.
+      encodings = backend_tokenizer.encode_batch(texts, add_special_tokens=True)
+      return [len(encoding) for encoding in encodings]
+    # Truncation or padding saved in tokenizer.json would change the lengths,
+    # and calling the tokenizer turns them off.
+    return get_slow_token_lens(texts, tokenizer)
+  if len(texts) <= TOKENIZE_CHUNK_SIZE:
+    return get_slow_token_lens(texts, tokenizer)
+  # Python tokenizers hold the GIL, so tokenize chunks in separate processes.
+  chunks = [
+      texts[i:i + TOKENIZE_CHUNK_SIZE]
+      for i in range(0, len(texts), TOKENIZE_CHUNK_SIZE)
+  ]
+  with ProcessPoolExecutor(
+      initializer=init_tokenize_worker, initargs=(tokenizer,)) as executor:
+    return [
+        token_len
+        for chunk_lens in executor.map(get_slow_token_lens, chunks)
+        for token_len in chunk_lens
+    ]
+
+def get_filtered_dataset_cache_path(
+    dataset_path: str,
+    max_input_len: int,
+    max_output_len: int,
+    tokenizer: PreTrainedTokenizerBase,
+) -> str:
+  """Returns the path caching the dataset filtered with the given config."""
+  key = repr((
+      tokenizer.name_or_path,
+      type(tokenizer).__name__,
+      len(tokenizer),
+      max_input_len,
+      max_output_len,
+      os.path.getmtime(dataset_path),
+  ))
+  digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+  return f"{dataset_path}.{digest}.filtered_indices.npz"
+
 def get_filtered_dataset(
     dataset_path: str,
     max_input_len: int,
     max_output_len: int,
     tokenizer: PreTrainedTokenizerBase,
     use_dummy_text: bool,
+    use_cache: bool = True,
 ) -> List[Tuple[str, int, int]]:
   """Samples requests from the dataset or creates dummy requests."""
   if use_dummy_text:
@@ -124,21 +254,32 @@ def get_filtered_dataset(
       (data["conversations"][0]["value"], data["conversations"][1]["value"])
       for data in dataset
   ]
+  prompts = [prompt for prompt, _ in dataset]
+
+  # Reuse the token counts and filtering of a previous run if possible. Only
+  # integer arrays are cached, the prompts are taken from the dataset.
+  cache_path = get_filtered_dataset_cache_path(
+      dataset_path, max_input_len, max_output_len, tokenizer)
+  if use_cache and os.path.exists(cache_path):
+    try:
+      with np.load(cache_path) as cache:
+        return list(zip(
+            [prompts[index] for index in cache["indices"].tolist()],
+            cache["prompt_lens"].tolist(),
+            cache["output_lens"].tolist(),
+        ))
+    except (OSError, KeyError, ValueError, IndexError) as e:
+      print(f"Ignoring invalid filtered dataset cache {cache_path}: {e}")
 
   # Tokenize the prompts and completions.
-  prompts = [prompt for prompt, _ in dataset]
-  prompt_token_ids = tokenizer(prompts).input_ids
+  prompt_lens = get_token_lens(tokenizer, prompts)
   completions = [completion for _, completion in dataset]
-  completion_token_ids = tokenizer(completions).input_ids
-  tokenized_dataset = []
-  for i in range(len(dataset)):
-    output_len = len(completion_token_ids[i])
-    tokenized_dataset.append((prompts[i], prompt_token_ids[i], output_len))
+  output_lens = get_token_lens(tokenizer, completions)
 
   # Filter out too long sequences.
+  filtered_indices: List[int] = []
   filtered_dataset: List[Tuple[str, int, int]] = []
-  for prompt, prompt_token_ids, output_len in tokenized_dataset:
-    prompt_len = len(prompt_token_ids)
+  for index, (prompt, prompt_len, output_len) in enumerate(zip(prompts, prompt_lens, output_lens)):
     if prompt_len < MIN_SEQ_LEN or output_len < MIN_SEQ_LEN:
       # Prune too short sequences.
       # This is because TGI causes errors when the input or output length
@@ -147,26 +288,52 @@ def get_filtered_dataset(
     if prompt_len > max_input_len or output_len > max_output_len:
       # Prune too long sequences.
       continue
+    filtered_indices.append(index)
     filtered_dataset.append((prompt, prompt_len, output_len))
 
+  if use_cache:
+    # Write to a temporary file first so that concurrent runs never read a
+    # partially written cache.
+    tmp_cache_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+      with open(tmp_cache_path, "wb") as f:
+        np.savez(
+            f,
+            indices=np.array(filtered_indices, dtype=np.int64),
+            prompt_lens=np.array([prompt_len for _, prompt_len, _ in filtered_dataset], dtype=np.int64),
+            output_lens=np.array([output_len for _, _, output_len in filtered_dataset], dtype=np.int64),
+        )
+      os.replace(tmp_cache_path, cache_path)
+    except OSError as e:
+      print(f"Failed to cache the filtered dataset to {cache_path}: {e}")
+      try:
+        os.remove(tmp_cache_path)
+      except OSError:
+        pass
+
   return filtered_dataset
 
 async def generate_next_request(
     input_requests: List[Tuple[str, int, int]],
     request_rate: float,
+    num_requests: int,
 ) -> AsyncGenerator[Tuple[str, int, int], None]:
   """Gets request async."""
-  while True:
-    request = random.choice(input_requests)
-    yield request
+  # Sample all requests and intervals up front in one vectorized call each.
+  request_indices = np.random.randint(0, len(input_requests), size=num_requests)
+  if request_rate == float("inf"):
+    # If the request rate is infinity, then we don't need to wait.
+    intervals = None
+  else:
+    # Sample the request intervals from the exponential distribution.
+    intervals = np.random.exponential(1.0 / request_rate, size=num_requests)
 
-    if request_rate == float("inf"):
-      # If the request rate is infinity, then we don't need to wait.
-      continue
-    # Sample the request interval from the exponential distribution.
-    interval = np.random.exponential(1.0 / request_rate)
-    # The next request will be sent after the interval.
-    await asyncio.sleep(interval)
+  for i, request_index in enumerate(request_indices):
+    yield input_requests[request_index]
+
+    if intervals is not None:
+      # The next request will be sent after the interval.
+      await asyncio.sleep(intervals[i])
 
 def init_errors_map() -> Dict[str, int]:
   errors = {
@@ -175,178 +342,117 @@ def init_errors_map() -> Dict[str, int]:
     "ContentTypeError": 0,
     "ClientOSError": 0,
     "ServerDisconnectedError": 0,
+    "ServerError": 0,
     "unknown_error": 0,
   }
   return errors
 
-async def send_stream_request(
-    backend: str,
-    api_url: str,
-    prompt: str,
-    prompt_len: int,
-    output_len: int,
-    ignore_eos: bool,
-    best_of: int,
-    use_beam_search: bool,
-    top_k: int,
-    tokenizer: PreTrainedTokenizerBase,
-    sax_model: str,
+async def iter_sse_frames(
+    content: aiohttp.StreamReader,
+) -> AsyncGenerator[bytes, None]:
+  """Yields complete server-sent event frames from a response stream."""
+  # Frames are split on the blank line ending each event here, since the
+  # separator may span two reads, which older aiohttp's readuntil misses.
+  buffer = b""
+  async for data in content.iter_any():
+    buffer += data
+    *frames, buffer = buffer.split(b"\n\n")
+    for frame in frames:
+      yield frame
+  if buffer:
+    yield buffer
+
+async def iter_http_chunks(
+    content: aiohttp.StreamReader,
+) -> AsyncGenerator[bytes, None]:
+  """Yields complete HTTP chunks, joining chunks split across reads."""
+  buffer = b""
+  async for data, end_of_http_chunk in content.iter_chunks():
+    buffer += data
+    if end_of_http_chunk:
+      yield buffer
+      buffer = b""
+  if buffer:
+    yield buffer
+
+def parse_vllm_chunk(chunk_bytes: bytes) -> Tuple[Optional[str], Optional[int]]:
+  """Returns the text and completion token count of a vLLM server-sent event.
+
+  The text is None for events that carry no token, and the token count is only
+  set on the final usage event.
+  """
+  # Skip the "data: " prefix without decoding the chunk to str.
+  data = memoryview(chunk_bytes)[6:]
+  if data == b"[DONE]":
+    return None, None
+  chunk = orjson.loads(data)
+  usage = chunk.get("usage")
+  completion_tokens = usage["completion_tokens"] if usage else None
+  if not chunk["choices"]:
+    return None, completion_tokens
+  return chunk["choices"][0]["text"], completion_tokens
+
+def parse_jetstream_chunk(chunk_bytes: bytes) -> Tuple[Optional[str], Optional[int]]:
+  """Returns the text of a JetStream response chunk."""
+  return orjson.loads(chunk_bytes)["text"], None
+
+def make_payload_factory(
+    args: argparse.Namespace,
     model: str,
-    timeout: float,
-    max_conn: int,
-) -> Tuple[Tuple[int, int, float], float, List[float], Dict[str, int]]:
-  """Sends stream request to server"""
-  request_start_time_ms = 1000 * time.time()
-  errors = init_errors_map()
-
-  headers = {"User-Agent": "Benchmark Client"}
+) -> Callable[[str, int], Dict]:
+  """Returns a function building the request payload of a prompt for a model.
+
+  Only the prompt and the output length change between requests, so the rest
+  of the payload is built once per benchmark run.
+  """
+  backend = args.backend
+  stream = args.stream_request
+  use_beam_search = args.use_beam_search
+  best_of = args.best_of
   if backend == "vllm":
-    pload = {
+    base = {
         "model": model,
-        "prompt": prompt,
         "n": 1,
         "best_of": best_of,
         "use_beam_search": use_beam_search,
         "temperature": 0.0 if use_beam_search else 1.0,
         "top_p": 1.0,
-        "max_tokens": output_len,
-        "ignore_eos": ignore_eos,
-        "stream": True,
-    }
-  elif backend == "jetstream":
-    pload = {
-        "prompt": prompt,
-        "max_tokens": output_len,
-        "stream": True,
-    }
-  else: 
-    raise ValueError(f"Unknown backend: {backend}")
-
-  ttft_ms = 0.0
-  itl_ms = []
-  start_time_ms = 1000 * time.perf_counter()
-  most_recent_timestamp = start_time_ms
-  output = ""
-  timeout = aiohttp.ClientTimeout(total=timeout)
-  async with aiohttp.ClientSession(timeout=timeout,trust_env=True,connector=aiohttp.TCPConnector(limit=max_conn)) as session:
-    try:
-      async with session.post(api_url, headers=headers, json=pload, ssl=False) as response:
-        async for chunk_bytes in response.content.iter_chunks():
-          chunk_bytes = chunk_bytes[0].strip()
-          if not chunk_bytes:
-              continue
-          timestamp_ms = 1000 * time.perf_counter()
-          # First token
-          if ttft_ms == 0.0:
-            ttft_ms = timestamp_ms - start_time_ms
-          else:
-            itl_ms.append(timestamp_ms - most_recent_timestamp)
-          most_recent_timestamp = timestamp_ms
-          if backend == "vllm":
-            if chunk_bytes.decode("utf-8")[6:] != "[DONE]":
-              output += json.loads(chunk_bytes.decode("utf-8")[6:])["choices"][0]["text"]
-          elif backend == "jetstream":
-            if chunk_bytes.decode("utf-8") != "":
-              output += json.loads(chunk_bytes.decode("utf-8"))["text"]
-          
-    except aiohttp.client_exceptions.ClientConnectorError as client_err:
-      errors["ClientConnectorError"] += 1
-      print(f"ClientConnectorError: {client_err}")
-      return None, None, None, errors
-    except asyncio.TimeoutError as timeout_err:
-      errors["TimeoutError"] += 1
-      print(f"TimeoutError: {timeout_err}")
-      return None, None, None, errors
-    except aiohttp.client_exceptions.ClientOSError as e:
-      errors["ClientOSError"] += 1
-      print(f"ClientOSError: {e}")
-      return None, None, None, errors
-    except aiohttp.client_exceptions.ContentTypeError as e:
-      print(f"ContentTypeError: {e}, response: {response}")
-      errors["ContentTypeError"] += 1
-      return None, None, None, errors
-    except aiohttp.client_exceptions.ServerDisconnectedError as e:
-      errors["ServerDisconnectedError"] += 1
-      print(f"ServerDisconnectedError: {e}")
-      return None, None, None, errors
-    except Exception as e: 
-      print(f"Unknown error {e}")
-      errors["unknown_error"] += 1
-      return None, None, None, errors
-  request_end_time_ms = 1000 * time.time()
-  output_token_ids = tokenizer(output).input_ids
-  output_len = len(output_token_ids)
-  request_latency_ms = (prompt_len, output_len, (request_end_time_ms - request_start_time_ms))
-
-  # Exclude first token for tpot calculation
-  if output_len > 1:
-    tpot_metric.observe((request_end_time_ms - ttft_ms - request_start_time_ms) / (output_len - 1))
-  normalized_time_per_output_token_metric.observe((request_end_time_ms - request_start_time_ms) / output_len)
-  if ttft_ms is not None:
-    ttft_metric.observe(ttft_ms)
-  prompt_length_metric.observe(prompt_len)
-  response_length_metric.observe(output_len)
-  return request_latency_ms, ttft_ms, itl_ms, None
-
-async def send_request(
-    backend: str,
-    api_url: str,
-    prompt: str,
-    prompt_len: int,
-    output_len: int,
-    ignore_eos: bool,
-    best_of: int,
-    use_beam_search: bool,
-    top_k: int,
-    tokenizer: PreTrainedTokenizerBase,
-    sax_model: str,
-    model: str,
-    timeout: float,
-    max_conn: int,
-) -> Tuple[Tuple[int, int, float], float, List[float], Dict[str, int]]:
-  """Sends request to server."""
-  request_start_time_ms = 1000 * time.time()
-  errors = init_errors_map()
-
-  headers = {"User-Agent": "Benchmark Client"}
-  if backend == "vllm":
-    pload = {
-        "model": model,
-        "prompt": prompt,
-        "n": 1,
-        "best_of": best_of,
-        "use_beam_search": use_beam_search,
-        "temperature": 0.0 if use_beam_search else 1.0,
-        "top_p": 1.0,
-        "max_tokens": output_len,
-        "ignore_eos": ignore_eos,
-        "stream": False,
+        "ignore_eos": args.ignore_eos,
+        "stream": stream,
     }
+    if stream:
+      base["stream_options"] = {"include_usage": True}
+    prompt_key, max_tokens_key = "prompt", "max_tokens"
   elif backend == "tgi":
     assert not use_beam_search
-    params = {
-        "best_of": best_of,
-        "max_new_tokens": output_len,
-        "do_sample": True,
-    }
-    pload = {
-        "inputs": prompt,
-        "parameters": params,
-    }
+
+    def make_tgi_payload(prompt: str, output_len: int) -> Dict:
+      return {
+          "inputs": prompt,
+          "parameters": {
+              "best_of": best_of,
+              "max_new_tokens": output_len,
+              "do_sample": True,
+              "details": True,
+          },
+      }
+    return make_tgi_payload
   elif backend == "naive_transformers":
+    top_k = args.top_k
+
     # If max_length or top_k is not specified _MAX_LENGTH_DEFAULT = 200 and
     # _TOP_K_DEFAULT = 10 in peft/handler.py will be used.
-    pload = {
-        "instances": [{
-            "prompt": prompt,
-            "max_length": output_len,
-            "top_k": top_k,
-        }]
-    }
+    def make_naive_transformers_payload(prompt: str, output_len: int) -> Dict:
+      return {
+          "instances": [{
+              "prompt": prompt,
+              "max_length": output_len,
+              "top_k": top_k,
+          }]
+      }
+    return make_naive_transformers_payload
   elif backend == "tensorrt_llm_triton":
-    pload = {
-        "text_input": prompt,
-        "max_tokens": output_len,
+    base = {
         "beam_width": 1 if not use_beam_search else best_of,
         "temperature": 0.0 if use_beam_search else 1.0,
         "top_p": 1.0,
@@ -354,64 +460,183 @@ async def send_request(
         "stop_words": "",
         "stream": False,
     }
+    prompt_key, max_tokens_key = "text_input", "max_tokens"
   elif backend == "sax":
-    pload = {
-        "model": sax_model,
-        "prompt": prompt,
+    base = {
+        "model": args.sax_model,
         "n": 1,
         "best_of": best_of,
         "use_beam_search": use_beam_search,
         "temperature": 0.0 if use_beam_search else 1.0,
         "top_p": 1.0,
         "top_k": 50,
-        "max_tokens": output_len,
         "stream": False,
     }
+    prompt_key, max_tokens_key = "prompt", "max_tokens"
   elif backend == "jetstream":
-    pload = {
-        "prompt": prompt,
-        "max_tokens": output_len,
-    }
+    base = {}
+    if stream:
+      base["stream"] = True
+    prompt_key, max_tokens_key = "prompt", "max_tokens"
   else:
     raise ValueError(f"Unknown backend: {backend}")
 
-  # Set client timeout to be 3 hrs.
-  timeout = aiohttp.ClientTimeout(total=timeout)
-  async with aiohttp.ClientSession(timeout=timeout,trust_env=True,trace_configs=[trace_config],connector=aiohttp.TCPConnector(limit=max_conn)) as session:
-    while True:
-      try:
-        async with session.post(api_url, headers=headers, json=pload, ssl=False) as response:
-          output = await response.json()
-
-        # Re-send the request if it failed.
-        if "error" not in output:
-          break
-      except aiohttp.client_exceptions.ClientConnectorError as client_err:
-        errors["ClientConnectorError"] += 1
-        print(f"ClientConnectorError: {client_err}")
-        return None, None, None, errors
-      except asyncio.TimeoutError as timeout_err:
-        errors["TimeoutError"] += 1
-        print(f"TimeoutError: {timeout_err}")
-        return None, None, None, errors
-      except aiohttp.client_exceptions.ClientOSError as e:
-        errors["ClientOSError"] += 1
-        print(f"ClientOSError: {e}")
-        return None, None, None, errors
-      except aiohttp.client_exceptions.ContentTypeError as e:
-        print(f"ContentTypeError: {e}, response: {response}")
-        errors["ContentTypeError"] += 1
-        return None, None, None, errors
-      except aiohttp.client_exceptions.ServerDisconnectedError as e:
-        errors["ServerDisconnectedError"] += 1
-        print(f"ServerDisconnectedError: {e}")
-        return None, None, None, errors
-      except Exception as e: 
-        print(f"Unknown error {e}")
-        errors["unknown_error"] += 1
-        return None, None, None, errors
-
-  request_end_time_ms = 1000 * time.time()
+  def make_payload(prompt: str, output_len: int) -> Dict:
+    pload = base.copy()
+    pload[prompt_key] = prompt
+    pload[max_tokens_key] = output_len
+    return pload
+  return make_payload
+
+async def send_stream_request(
+    backend: str,
+    api_url: str,
+    prompt: str,
+    prompt_len: int,
+    output_len: int,
+    make_payload: Callable[[str, int], Dict],
+    tokenizer: PreTrainedTokenizerBase,
+    session: aiohttp.ClientSession,
+    request_start_ns: int,
+) -> Tuple[Tuple[int, int, float], float, List[float], Dict[str, int]]:
+  """Sends stream request to server, timing it from request_start_ns."""
+  pload = make_payload(prompt, output_len)
+  if backend == "vllm":
+    iter_frames = iter_sse_frames
+    parse_chunk = parse_vllm_chunk
+  elif backend == "jetstream":
+    iter_frames = iter_http_chunks
+    parse_chunk = parse_jetstream_chunk
+  else: 
+    raise ValueError(f"Unknown backend: {backend}")
+
+  # Timestamps are integer nanoseconds of the monotonic clock, converted to
+  # milliseconds once the request is done.
+  first_token_ns = 0
+  itl_ns = []
+  most_recent_timestamp_ns = request_start_ns
+  output_parts: List[str] = []
+  tokens_seen = 0
+  completion_tokens = None
+  try:
+    async with session.post(api_url, headers=REQUEST_HEADERS, data=orjson.dumps(pload), ssl=False) as response:
+      async for chunk_bytes in iter_frames(response.content):
+        chunk_bytes = chunk_bytes.strip()
+        if not chunk_bytes:
+            continue
+        timestamp_ns = time.perf_counter_ns()
+        text, chunk_completion_tokens = parse_chunk(chunk_bytes)
+        if chunk_completion_tokens is not None:
+          completion_tokens = chunk_completion_tokens
+        if text is None:
+          # Usage and [DONE] events are not tokens.
+          continue
+        # First token
+        if first_token_ns == 0:
+          first_token_ns = timestamp_ns
+        else:
+          itl_ns.append(timestamp_ns - most_recent_timestamp_ns)
+        most_recent_timestamp_ns = timestamp_ns
+        output_parts.append(text)
+        tokens_seen += 1
+  except aiohttp.client_exceptions.ClientConnectorError as client_err:
+    request_logger.warning("ClientConnectorError: %s", client_err)
+    return None, None, None, {"ClientConnectorError": 1}
+  except asyncio.TimeoutError as timeout_err:
+    request_logger.warning("TimeoutError: %s", timeout_err)
+    return None, None, None, {"TimeoutError": 1}
+  except aiohttp.client_exceptions.ClientOSError as e:
+    request_logger.warning("ClientOSError: %s", e)
+    return None, None, None, {"ClientOSError": 1}
+  except aiohttp.client_exceptions.ContentTypeError as e:
+    request_logger.warning("ContentTypeError: %s, response: %s", e, response)
+    return None, None, None, {"ContentTypeError": 1}
+  except aiohttp.client_exceptions.ServerDisconnectedError as e:
+    request_logger.warning("ServerDisconnectedError: %s", e)
+    return None, None, None, {"ServerDisconnectedError": 1}
+  except Exception as e: 
+    request_logger.warning("Unknown error %s", e)
+    request_logger.debug("Unknown error traceback", exc_info=True)
+    return None, None, None, {"unknown_error": 1}
+  request_end_ns = time.perf_counter_ns()
+  if completion_tokens is not None:
+    output_len = completion_tokens
+  elif backend == "jetstream":
+    # JetStream streams one chunk per generated token.
+    output_len = tokens_seen
+  else:
+    # Fall back to tokenizing the output if the server reported no usage.
+    output_token_ids = tokenizer("".join(output_parts)).input_ids
+    output_len = len(output_token_ids)
+  latency_ms = (request_end_ns - request_start_ns) / 1e6
+  ttft_ms = (first_token_ns - request_start_ns) / 1e6 if first_token_ns else 0.0
+  itl_ms = [itl / 1e6 for itl in itl_ns]
+  request_latency_ms = (prompt_len, output_len, latency_ms)
+
+  # Exclude first token for tpot calculation
+  if output_len > 1:
+    metric_observations.tpots.append((latency_ms - ttft_ms) / (output_len - 1))
+  if output_len > 0:
+    metric_observations.normalized_tpots.append(latency_ms / output_len)
+  metric_observations.ttfts.append(ttft_ms)
+  metric_observations.prompt_lens.append(prompt_len)
+  metric_observations.response_lens.append(output_len)
+  return request_latency_ms, ttft_ms, itl_ms, None
+
+async def send_request(
+    backend: str,
+    api_url: str,
+    prompt: str,
+    prompt_len: int,
+    output_len: int,
+    make_payload: Callable[[str, int], Dict],
+    tokenizer: PreTrainedTokenizerBase,
+    session: aiohttp.ClientSession,
+    max_retries: int,
+    request_start_ns: int,
+) -> Tuple[Tuple[int, int, float], float, List[float], Dict[str, int]]:
+  """Sends request to server, timing it from request_start_ns."""
+  pload = make_payload(prompt, output_len)
+
+  for attempt in range(max_retries + 1):
+    if attempt > 0:
+      retried_request_count.inc()
+      # Back off exponentially before re-sending the request. The backoff is
+      # the client's own delay, so it is left out of the request latency.
+      backoff_start_ns = time.perf_counter_ns()
+      await asyncio.sleep(min(0.1 * 2 ** (attempt - 1), 2.0))
+      request_start_ns += time.perf_counter_ns() - backoff_start_ns
+    try:
+      async with session.post(api_url, headers=REQUEST_HEADERS, data=orjson.dumps(pload), ssl=False) as response:
+        output = orjson.loads(await response.read())
+
+      # Re-send the request if it failed.
+      if "error" not in output:
+        break
+    except aiohttp.client_exceptions.ClientConnectorError as client_err:
+      request_logger.warning("ClientConnectorError: %s", client_err)
+      return None, None, None, {"ClientConnectorError": 1}
+    except asyncio.TimeoutError as timeout_err:
+      request_logger.warning("TimeoutError: %s", timeout_err)
+      return None, None, None, {"TimeoutError": 1}
+    except aiohttp.client_exceptions.ClientOSError as e:
+      request_logger.warning("ClientOSError: %s", e)
+      return None, None, None, {"ClientOSError": 1}
+    except (aiohttp.client_exceptions.ContentTypeError, orjson.JSONDecodeError) as e:
+      request_logger.warning("ContentTypeError: %s, response: %s", e, response)
+      return None, None, None, {"ContentTypeError": 1}
+    except aiohttp.client_exceptions.ServerDisconnectedError as e:
+      request_logger.warning("ServerDisconnectedError: %s", e)
+      return None, None, None, {"ServerDisconnectedError": 1}
+    except Exception as e: 
+      request_logger.warning("Unknown error %s", e)
+      request_logger.debug("Unknown error traceback", exc_info=True)
+      return None, None, None, {"unknown_error": 1}
+  else:
+    request_logger.warning("ServerError: %s", output["error"])
+    return None, None, None, {"ServerError": 1}
+
+  request_end_ns = time.perf_counter_ns()
   # Naive HF transformers generation and TensorRT-LLM generation stops at EOS
   # tokens and the generation may be shorter than the ground-truth output
   # sequence length.
@@ -428,36 +653,63 @@ async def send_request(
     output_token_ids = tokenizer(output["choices"][0]["text"]).input_ids
     output_len = len(output_token_ids)
   elif backend == "tgi":
-    output_token_ids = tokenizer(output["generated_text"]).input_ids
-    output_len = len(output_token_ids)
+    # Use the generated token count reported by the server when available.
+    if output.get("details"):
+      output_len = output["details"]["generated_tokens"]
+    else:
+      output_token_ids = tokenizer(output["generated_text"]).input_ids
+      output_len = len(output_token_ids)
   elif backend == "vllm":
-    output_token_ids = tokenizer(output["choices"][0]["text"]).input_ids
-    output_len = len(output_token_ids)
+    # Use the completion token count reported by the server when available.
+    if output.get("usage"):
+      output_len = output["usage"]["completion_tokens"]
+    else:
+      output_token_ids = tokenizer(output["choices"][0]["text"]).input_ids
+      output_len = len(output_token_ids)
   elif backend == "jetstream":
     output_token_ids = tokenizer(output["response"]).input_ids
     output_len = len(output_token_ids)
 
   # (prompt len, output len, latency, success)
-  request_latency_ms = (prompt_len, output_len, (request_end_time_ms - request_start_time_ms))
-  normalized_time_per_output_token_metric.observe((request_end_time_ms - request_start_time_ms) / output_len)
-  prompt_length_metric.observe(prompt_len)
-  response_length_metric.observe(output_len)
+  latency_ms = (request_end_ns - request_start_ns) / 1e6
+  request_latency_ms = (prompt_len, output_len, latency_ms)
+  if output_len > 0:
+    metric_observations.normalized_tpots.append(latency_ms / output_len)
+  metric_observations.prompt_lens.append(prompt_len)
+  metric_observations.response_lens.append(output_len)
 
   return request_latency_ms, None, None, None
 
 
+def get_ttfts_and_tpots(
+    request_latencies: np.ndarray,
+    ttfts: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+  """Returns the TTFT and TPOT of each request that measured a first token.
+
+  request_latencies has one (prompt_len, output_len, latency_ms) row per
+  request and ttfts is 0 for requests without a first token.
+  """
+  has_ttft = ttfts > 0
+  output_lens = request_latencies[has_ttft, 1]
+  latencies = request_latencies[has_ttft, 2]
+  ttfts = ttfts[has_ttft]
+  # Exclude first token for tpot calculation
+  tpots = np.where(output_lens > 1, (latencies - ttfts) / np.maximum(output_lens - 1, 1), 0.0)
+  return ttfts, tpots
+
 async def run_single_request(args: argparse.Namespace, api_url: str, tokenizer: PreTrainedTokenizerBase,
-                               prompt: str, prompt_len: int, output_len: int, chosen_model: str) -> Tuple[str, Tuple]:
+                               prompt: str, prompt_len: int, output_len: int, chosen_model: str,
+                               make_payload: Callable[[str, int], Dict],
+                               session: aiohttp.ClientSession, request_start_ns: int) -> Tuple[str, Tuple]:
     if args.stream_request:
         result = await send_stream_request(
-            args.backend, api_url, prompt, prompt_len, output_len, args.ignore_eos,
-            args.best_of, args.use_beam_search, args.top_k, tokenizer, args.sax_model,
-            chosen_model, args.request_timeout, args.tcp_conn_limit)
+            args.backend, api_url, prompt, prompt_len, output_len, make_payload,
+            tokenizer, session, request_start_ns)
     else:
         result = await send_request(
-            args.backend, api_url, prompt, prompt_len, output_len, args.ignore_eos,
-            args.best_of, args.use_beam_search, args.top_k, tokenizer, args.sax_model,
-            chosen_model, args.request_timeout, args.tcp_conn_limit)
+            args.backend, api_url, prompt, prompt_len, output_len, make_payload,
+            tokenizer, session, args.max_retries, request_start_ns)
     return chosen_model, result
 
 async def benchmark(
@@ -471,7 +723,8 @@ async def benchmark(
     Also saves results separately for each model.
     """
     input_requests = get_filtered_dataset(
-        args.dataset, args.max_input_length, args.max_output_length, tokenizer, args.use_dummy_text)
+        args.dataset, args.max_input_length, args.max_output_length, tokenizer, args.use_dummy_text,
+        args.dataset_cache)
     
     # Combine the models list and traffic split list into a dict
 
@@ -485,56 +738,98 @@ async def benchmark(
         raise ValueError(f"Traffic split must sum to 1.0, but got {total_weight}")
     models_dict = dict(zip(models, traffic_split))
     model_names = list(models_dict.keys())
-    model_weights = list(models_dict.values())
+    model_weights = np.array(list(models_dict.values())) / total_weight
+    # Build the payload of each model once instead of for every request.
+    payload_factories = {model: make_payload_factory(args, model) for model in model_names}
+    # Pick the model of every request up front, with one binary search of the
+    # cumulative traffic split per request.
+    if len(model_names) == 1:
+      model_indices = np.zeros(args.num_prompts, dtype=np.int64)
+    else:
+      cumulative_weights = np.cumsum(model_weights)
+      # Guard against rounding leaving the total slightly below 1.
+      cumulative_weights[-1] = 1.0
+      model_indices = np.searchsorted(cumulative_weights, np.random.random(args.num_prompts), side="right")
 
-    benchmark_start_time_sec = time.time()
+    benchmark_start_time_sec = time.perf_counter()
     # Initialize the counter with target prompts
-    await AsyncRequestCounter(args.num_prompts)
-    tasks: List[asyncio.Task] = []
+    global request_counter
+    request_counter = RequestCounter(args.num_prompts)
+    global metric_observations
+    metric_observations = MetricObservations()
     prompts_sent = 0
-    async for request in generate_next_request(input_requests, args.request_rate):
-        if prompts_sent >= args.num_prompts:
-            break
-        prompt, prompt_len, output_len = request
-        chosen_model = random.choices(model_names, weights=model_weights)[0]
-        task = asyncio.create_task(run_single_request(args, api_url, tokenizer, prompt, prompt_len, output_len, chosen_model))
-        tasks.append(task)
-        prompts_sent += 1
-
-    results = await asyncio.gather(*tasks)
-
-    overall_results = {"latencies": [], "ttfts": [], "itls": [], "tpots": [], "errors": init_errors_map()}
-    per_model_results: Dict[str, Dict[str, List]] = {}
+    results: List[Tuple[str, Tuple]] = []
+    # Requests are queued as they arrive and sent by a fixed pool of workers,
+    # one per connection, instead of creating a task for every request. They
+    # are timed from their arrival, so time spent queued behind a busy server
+    # counts towards their latency, as waiting for a free connection did.
+    queue: asyncio.Queue = asyncio.Queue()
+    # A connection limit of 0 means no limit.
+    num_workers = args.tcp_conn_limit or args.num_prompts
+
+    async def worker(session: aiohttp.ClientSession):
+      while True:
+        request = await queue.get()
+        if request is None:
+          return
+        prompt, prompt_len, output_len, chosen_model, arrival_ns = request
+        request_counter.increment()
+        results.append(await run_single_request(args, api_url, tokenizer, prompt, prompt_len, output_len, chosen_model, payload_factories[chosen_model], session, arrival_ns))
+
+    # All requests share one session so connections are kept alive and reused
+    # across requests instead of being re-established for every request.
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    connector = aiohttp.TCPConnector(limit=args.tcp_conn_limit, ttl_dns_cache=300)
+    # Tracing costs an extra callback per request, so it is only enabled when
+    # the request count has to be exported while the benchmark runs.
+    trace_configs = [trace_config] if args.trace_requests else []
+    async with aiohttp.ClientSession(timeout=timeout, trust_env=True, trace_configs=trace_configs, connector=connector) as session:
+      workers = [asyncio.create_task(worker(session)) for _ in range(num_workers)]
+      async for request in generate_next_request(input_requests, args.request_rate, args.num_prompts):
+          prompt, prompt_len, output_len = request
+          chosen_model = model_names[model_indices[prompts_sent]]
+          queue.put_nowait((prompt, prompt_len, output_len, chosen_model, time.perf_counter_ns()))
+          prompts_sent += 1
+
+      # Stop the workers once every request has been sent.
+      for _ in workers:
+          queue.put_nowait(None)
+      await asyncio.gather(*workers)
+    metric_observations.observe()
+
+    overall_errors = init_errors_map()
+    per_model_results: Dict[str, Dict] = {}
     for model in model_names:
-        per_model_results[model] = {"latencies": [], "ttfts": [], "itls": [], "tpots": [], "errors": init_errors_map()}
+        per_model_results[model] = {"latencies": [], "ttfts": [], "itls": [], "errors": init_errors_map()}
 
     for chosen_model, res in results:
         if res is None:
             continue
         latency, ttft_ms, itl_ms, errors = res
+        model_results = per_model_results[chosen_model]
         if errors:
           for k, v in errors.items():
-              overall_results["errors"][k] += v
-              per_model_results[chosen_model]["errors"][k] += v
+              overall_errors[k] += v
+              model_results["errors"][k] += v
         else:
-          prompt_len, output_len, request_latency_ms = latency
-          overall_results["latencies"].append(latency)
-          per_model_results[chosen_model]["latencies"].append(latency)
-          if ttft_ms:
-              overall_results["ttfts"].append(ttft_ms)
-              overall_results["tpots"].append((request_latency_ms - ttft_ms) / (output_len - 1) if output_len > 1 else 0)
-              per_model_results[chosen_model]["ttfts"].append(ttft_ms)
-              per_model_results[chosen_model]["tpots"].append((request_latency_ms - ttft_ms) / (output_len - 1) if output_len > 1 else 0)
+          model_results["latencies"].append(latency)
+          model_results["ttfts"].append(ttft_ms or 0.0)
           if itl_ms:
-              overall_results["itls"].extend(itl_ms)     
-              per_model_results[chosen_model]["itls"].extend(itl_ms)     
+              model_results["itls"].extend(itl_ms)
+
+    # Derive the TPOTs of every model at once from the collected results.
+    for data in per_model_results.values():
+        data["latencies"] = np.array(data["latencies"], dtype=np.float64).reshape(-1, 3)
+        data["ttfts"], data["tpots"] = get_ttfts_and_tpots(data["latencies"], np.array(data["ttfts"], dtype=np.float64))
 
-    benchmark_duration_sec = time.time() - benchmark_start_time_sec
+    benchmark_duration_sec = time.perf_counter() - benchmark_start_time_sec
     
     await print_and_save_result(args, benchmark_duration_sec, prompts_sent, "weighted",
-                          overall_results["latencies"], overall_results["ttfts"],
-                          overall_results["itls"], overall_results["tpots"],
-                          overall_results["errors"])
+                          np.concatenate([data["latencies"] for data in per_model_results.values()]),
+                          np.concatenate([data["ttfts"] for data in per_model_results.values()]),
+                          [itl for data in per_model_results.values() for itl in data["itls"]],
+                          np.concatenate([data["tpots"] for data in per_model_results.values()]),
+                          overall_errors)
     for model, data in per_model_results.items():
         await print_and_save_result(args, benchmark_duration_sec, len(data["latencies"]), model,
                               data["latencies"], data["ttfts"], data["itls"],
@@ -637,12 +932,13 @@ def save_json_results(args: argparse.Namespace, benchmark_result, server_metrics
     except google.cloud.exceptions.NotFound:
       print(f"GS Bucket (gs://{args.output_bucket}) does not exist")
 
-def metrics_to_scrape(backend: str) -> List[str]:
+@functools.lru_cache(maxsize=8)
+def metrics_to_scrape(backend: str) -> Tuple[str, ...]:
   # Each key in the map is a metric, it has a corresponding 'stats' object
   # It must be populated on the outputs 'metrics' field as 'key':'stats'
   # If a value is specified for a given key, it will be populated on the outputs `summary_stats.stats` field as 'value':'stats' as well.
   if backend == "vllm":
-    return [
+    return (
       "vllm:cpu_cache_usage_perc",
       "vllm:gpu_cache_usage_perc",
 
@@ -673,158 +969,234 @@ def metrics_to_scrape(backend: str) -> List[str]:
 
       "vllm:avg_generation_throughput_toks_per_s",
       "vllm:avg_prompt_throughput_toks_per_s",
-    ]
+    )
   elif backend == "jetstream":
-    return [
+    return (
       "jetstream_slots_used_percentage",
       "jetstream_prefill_backlog_size",
-    ]
+    )
   else:
-    return []
+    return ()
+
+async def query_metrics_server(
+    session: aiohttp.ClientSession,
+    url: str,
+    params: Optional[Dict[str, str]] = None,
+) -> Tuple[bool, Dict]:
+  """Returns whether a metrics server request succeeded and its response."""
+  async with session.get(url, params=params) as response:
+    return response.ok, orjson.loads(await response.read())
+
+# PromQL queries of each aggregation per metric type, formatted with the metric
+# name, its label filters, the range duration d of the benchmark and rate, the
+# per-second rate of the metric over d.
+METRIC_QUERY_TEMPLATES = {
+    "gauge": {
+        "Mean": "avg_over_time({metric}{filters}[{d}])",
+        "Median": "quantile_over_time(0.5, {metric}{filters}[{d}])",
+        "Sd": "stddev_over_time({metric}{filters}[{d}])",
+        "Min": "min_over_time({metric}{filters}[{d}])",
+        "Max": "max_over_time({metric}{filters}[{d}])",
+        "P90": "quantile_over_time(0.9, {metric}{filters}[{d}])",
+        "P95": "quantile_over_time(0.95, {metric}{filters}[{d}])",
+        "P99": "quantile_over_time(0.99, {metric}{filters}[{d}])",
+    },
+    "histogram": {
+        "Mean": "sum(rate({metric}_sum{filters}[{d}])) / sum(rate({metric}_count{filters}[{d}]))",
+        "Median": "histogram_quantile(0.5, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+        "Min": "histogram_quantile(0, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+        "Max": "histogram_quantile(1, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+        "P90": "histogram_quantile(0.9, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+        "P95": "histogram_quantile(0.95, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+        "P99": "histogram_quantile(0.99, sum(rate({metric}_bucket{filters}[{d}])) by (le))",
+    },
+    "counter": {
+        "Sum": "sum_over_time({metric}{filters}[{d}])",
+        "Rate": "{rate}",
+        "Increase": "increase({metric}{filters}[{d}])",
+        "Mean": "avg_over_time({rate}[{d}:{d}])",
+        "Max": "max_over_time({rate}[{d}:{d}])",
+        "Min": "min_over_time({rate}[{d}:{d}])",
+        "P90": "quantile_over_time(0.9, {rate}[{d}:{d}])",
+        "P95": "quantile_over_time(0.95, {rate}[{d}:{d}])",
+        "P99": "quantile_over_time(0.99, {rate}[{d}:{d}])",
+    },
+}
+
+@functools.lru_cache(maxsize=256)
+def get_metric_queries(
+    metric_type: str, metric: str, filters: str, d: str
+) -> Dict[str, str]:
+  """Returns the PromQL query of each aggregation of metric, by name."""
+  rate = f"rate({metric}{filters}[{d}])"
+  return {
+      query_name: template.format(metric=metric, filters=filters, d=d, rate=rate)
+      for query_name, template in METRIC_QUERY_TEMPLATES[metric_type].items()
+  }
 
-def print_metrics(metrics: List[str], duration_sec: float, namespace: str, job: str):
+@functools.lru_cache(maxsize=1)
+def get_default_credentials():
   # Creates a credentials object from the default service account file
   # Assumes that script has appropriate default credentials set up, ref:
   # https://googleapis.dev/python/google-auth/latest/user-guide.html#application-default-credentials
-  credentials, project_id = google.auth.default()
-  # Prepare an authentication request - helps format the request auth token
-  auth_req = google.auth.transport.requests.Request()
-
+  return google.auth.default()
+
+async def print_metrics(metrics: Tuple[str, ...], duration_sec: float, namespace: str, job: str, max_conn: int):
+  # Results of every model are scraped with the same credentials, which are
+  # only refreshed when the token is missing or expired.
+  credentials, project_id = get_default_credentials()
+  if not credentials.valid:
+    # Prepare an authentication request - helps format the request auth token
+    auth_req = google.auth.transport.requests.Request()
+    # Request refresh tokens
+    credentials.refresh(auth_req)
+  headers_api = {'Authorization': 'Bearer ' + credentials.token}
+  # All queries are sent concurrently over one keep-alive session.
+  connector = aiohttp.TCPConnector(limit=max_conn, keepalive_timeout=60)
+  async with aiohttp.ClientSession(headers=headers_api, connector=connector, trust_env=True) as session:
+    return await query_server_metrics(session, project_id, metrics, duration_sec, namespace, job)
+
+async def query_server_metrics(
+    session: aiohttp.ClientSession,
+    project_id: str,
+    metrics: Tuple[str, ...],
+    duration_sec: float,
+    namespace: str,
+    job: str,
+) -> Dict[str, Dict[str, float]]:
+  """Queries the aggregations of each metric concurrently through session."""
   server_metrics = {}
 
-  # Request refresh tokens
-  credentials.refresh(auth_req)
   url='https://monitoring.googleapis.com/v1/projects/%s/location/global/prometheus/api/v1/metadata' % (project_id)
-  headers_api = {'Authorization': 'Bearer ' + credentials.token}
-  request_post = requests.get(url=url, headers=headers_api)
-  all_metrics_metadata = request_post.json()
-  if request_post.ok is not True:
+  ok, all_metrics_metadata = await query_metrics_server(session, url)
+  if ok is not True:
     print("HTTP Error: %s" % (all_metrics_metadata))
     return server_metrics
   if all_metrics_metadata["status"] != "success":
     print("Metadata error response: %s" % all_metrics_metadata["error"])
     return server_metrics
 
+  # Queries scrape all metrics collected from the last $DURATION seconds from the backend's related
+  # podmonitoring spec assumed to be named "$BACKEND-podmonitoring"
+  filters = ""
+  if job != "":
+      filters += f'job="{job}"'
+  if namespace != "":
+      if filters != "":
+          filters += ","
+      filters += f'namespace="{namespace}"'
+  if filters != "":
+      filters = f"{{{filters}}}"
+  d = f"{duration_sec:.0f}s"
+
+  metric_queries = []
   for metric in metrics:
     # Find metric type
     if metric not in all_metrics_metadata['data']:
-      logger.debug(f"No metric found for {metric}")
+      logger.debug("No metric found for %s", metric)
       continue
     metric_type = all_metrics_metadata['data'][metric]
     metric_type = metric_type[0]['type']
 
+    queries = get_metric_queries(metric_type, metric, filters, d)
+    metric_queries.append((metric, queries))
+
+  # Configure respective query
+  url='https://monitoring.googleapis.com/v1/projects/%s/location/global/prometheus/api/v1/query' % (project_id)
+  # All aggregations of a metric are fetched by one query, tagging the series
+  # of each aggregation with its name in an "agg" label.
+  composite_queries = []
+  for metric, queries in metric_queries:
+    for query_name, query in queries.items():
+      logger.debug("Finding %s %s with the following query: %s", query_name, metric, query)
+    composite_queries.append(" or ".join(
+        f'label_replace({query}, "agg", "{query_name}", "", "")'
+        for query_name, query in queries.items()
+    ))
+  responses = await asyncio.gather(*[
+      query_metrics_server(session, url, {'query': query})
+      for query in composite_queries
+  ])
+
+  for (metric, queries), (ok, response) in zip(metric_queries, responses):
     metric_results = {}
-    # Queries scrape all metrics collected from the last $DURATION seconds from the backend's related
-    # podmonitoring spec assumed to be named "$BACKEND-podmonitoring"
-
-    filters = ""
-    if job != "":
-        filters += f'job="{job}"'
-    if namespace != "":
-        if filters != "":
-            filters += ","
-        filters += f'namespace="{namespace}"'
-    if filters != "":
-        filters = f"{{{filters}}}"
-
-    queries = {
-        "gauge": {
-            "Mean": f"avg_over_time({metric}{filters}[{duration_sec:.0f}s])",
-            "Median": f"quantile_over_time(0.5, {metric}{filters}[{duration_sec:.0f}s])",
-            "Sd": f"stddev_over_time({metric}{filters}[{duration_sec:.0f}s])",
-            "Min": f"min_over_time({metric}{filters}[{duration_sec:.0f}s])",
-            "Max": f"max_over_time({metric}{filters}[{duration_sec:.0f}s])",
-            "P90": f"quantile_over_time(0.9, {metric}{filters}[{duration_sec:.0f}s])",
-            "P95": f"quantile_over_time(0.95, {metric}{filters}[{duration_sec:.0f}s])",
-            "P99": f"quantile_over_time(0.99, {metric}{filters}[{duration_sec:.0f}s])",
-        },
-        "histogram": {
-            "Mean": f"sum(rate({metric}_sum{filters}[{duration_sec:.0f}s])) / sum(rate({metric}_count{filters}[{duration_sec:.0f}s]))",
-            "Median": f"histogram_quantile(0.5, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-            "Min": f"histogram_quantile(0, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-            "Max": f"histogram_quantile(1, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-            "P90": f"histogram_quantile(0.9, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-            "P95": f"histogram_quantile(0.95, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-            "P99": f"histogram_quantile(0.99, sum(rate({metric}_bucket{filters}[{duration_sec:.0f}s])) by (le))",
-        },
-        "counter": {
-            "Sum": f"sum_over_time({metric}{filters}[{duration_sec:.0f}s])",
-            "Rate": f"rate({metric}{filters}[{duration_sec:.0f}s])",
-            "Increase": f"increase({metric}{filters}[{duration_sec:.0f}s])",
-            "Mean": f"avg_over_time(rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-            "Max": f"max_over_time(rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-            "Min": f"min_over_time(rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-            "P90": f"quantile_over_time(0.9, rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-            "P95": f"quantile_over_time(0.95, rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-            "P99": f"quantile_over_time(0.99, rate({metric}{filters}[{duration_sec:.0f}s])[{duration_sec:.0f}s:{duration_sec:.0f}s])",
-        },
-    }
+    server_metrics[metric] = metric_results
+    logger.debug("Got response from metrics server: %s", response)
 
-    for query_name, query in queries[metric_type].items():
-      # Configure respective query
-      url='https://monitoring.googleapis.com/v1/projects/%s/location/global/prometheus/api/v1/query' % (project_id)
-      headers_api = {'Authorization': 'Bearer ' + credentials.token}
-      params = {'query': query}
-      logger.debug(f"Finding {query_name} {metric} with the following query: {query}")
-      request_post = requests.get(url=url, headers=headers_api, params=params)
-      response = request_post.json()
-
-      logger.debug(f"Got response from metrics server: {response}")
-
-      # handle response
-      if request_post.ok:
-        if response["status"] == "success" and response["data"] and response["data"]["result"]:
-          r = response["data"]["result"]
-          if not r:
-            logger.debug(f"Failed to get result for {query_name}")
-            continue
-          v = r[0].get("value", None)
-          if not v:
-            logger.debug(f"Failed to get value for result: {r}")
-            continue
-          metric_results[query_name] = float(v[1])
-          logger.debug("%s: %s" % (query_name, v[1]))
-        else:
-          logger.debug("Cloud Monitoring PromQL Error: %s" % (response))
-          continue
-      else:
-        logger.debug("HTTP Error: %s" % (response))
+    # handle response
+    if not ok:
+      logger.debug("HTTP Error: %s", response)
+      continue
+    if response["status"] != "success" or not response["data"] or not response["data"]["result"]:
+      logger.debug("Cloud Monitoring PromQL Error: %s", response)
+      continue
+    results = []
+    for r in response["data"]["result"]:
+      if not r.get("value", None):
+        logger.debug("Failed to get value for result: %s", r)
         continue
-    server_metrics[metric] = metric_results
+      results.append(r)
+    aggs = [r["metric"].get("agg") for r in results]
+    vals = np.fromiter(
+        (r["value"][1] for r in results), dtype=np.float64, count=len(results)
+    )
+    # Keep the first series of each aggregation.
+    values = dict(zip(reversed(aggs), reversed(vals.tolist())))
+    logger.debug("%s: %s", metric, values)
+    for query_name in queries:
+      if query_name not in values:
+        logger.debug("Failed to get result for %s", query_name)
+        continue
+      metric_results[query_name] = values[query_name]
   
   return server_metrics
 
-def get_stats_for_set(name, description, points):
-  avg = np.mean(points) if points else 0
-  median = np.median(points) if points else 0
-  sd = np.std(points) if points else 0
-  min = np.min(points) if points else 0
-  max = np.max(points) if points else 0
-  p90 = np.percentile(points, 90) if points else 0
-  p99 = np.percentile(points, 99) if points else 0
-
-  print(f"Average {description}:" f" {avg:.2f}")
-
-  return {
-    f'avg_{name}':  avg,
-    f'median_{name}': median,
-    f'sd_{name}': sd,
-    f'min_{name}': min,
-    f'max_{name}': max,
-    f'p90_{name}': p90,
-    f'p99_{name}': p99,
-  }
+def get_int_quantiles(points: np.ndarray, quantiles: List[float]) -> np.ndarray:
+  """Returns the quantiles of non-negative integer points.
+
+  Matches np.quantile, but locates the order statistics from a histogram of the
+  points, which is linear in the number of points plus their largest value.
+  """
+  cumulative_counts = np.cumsum(np.bincount(points.astype(np.int64)))
+  positions = (points.size - 1) * np.asarray(quantiles)
+  lower = np.floor(positions).astype(np.int64)
+  upper = np.minimum(lower + 1, points.size - 1)
+  lower_values = np.searchsorted(cumulative_counts, lower, side="right")
+  upper_values = np.searchsorted(cumulative_counts, upper, side="right")
+  return lower_values + (positions - lower) * (upper_values - lower_values)
+
+def get_stats_for_set(name, points, integer=False):
+  points = np.asarray(points, dtype=np.float64)
+  keys = [f'{stat}_{name}' for stat in ('avg', 'median', 'sd', 'min', 'max', 'p90', 'p99')]
+  if points.size == 0:
+    return dict.fromkeys(keys, 0)
+  mn = points.min()
+  mx = points.max()
+  # Output lengths of some backends can be negative, which can't be counted.
+  if integer and mn >= 0:
+    # Token counts are small integers, so counting beats partitioning.
+    median, p90, p99 = get_int_quantiles(points, [0.5, 0.9, 0.99])
+  else:
+    # Compute all quantiles from a single partition of the points.
+    median, p90, p99 = np.quantile(points, [0.5, 0.9, 0.99])
+  avg = points.mean()
+  sd = points.std()
+  return dict(zip(keys, (avg, median, sd, mn, mx, p90, p99)))
 
 async def print_and_save_result(args: argparse.Namespace, benchmark_duration_sec, total_requests, model, request_latencies, ttfts, itls, tpots, errors):
   benchmark_result = {}
+  # Split the (prompt_len, output_len, latency) rows into one array per column.
+  request_latencies = np.asarray(request_latencies, dtype=np.float64).reshape(-1, 3)
+  prompt_lens = request_latencies[:, 0]
+  output_lens = request_latencies[:, 1]
+  latencies = request_latencies[:, 2]
 
   print(f"====Result for Model: {model}====")
   print(f"Errors: {errors}")
   print(f"Total time (seconds): {benchmark_duration_sec:.2f} s")
   print(f"Successful/total requests: {len(request_latencies)}/{total_requests}")
   print(f"Requests/sec: {total_requests / benchmark_duration_sec:.2f}")
-  counter = await AsyncRequestCounter()
-  queries_per_second = await counter.get_qps()
+  queries_per_second = request_counter.get_qps()
   print(f"Queries/sec: {queries_per_second:.2f}")
   benchmark_result['queries_per_second'] = queries_per_second
   benchmark_result["num_prompts_attempted"] = total_requests
@@ -832,16 +1204,14 @@ async def print_and_save_result(args: argparse.Namespace, benchmark_duration_sec
   benchmark_result['benchmark_time'] = benchmark_duration_sec
   benchmark_result['throughput_rps'] = (args.num_prompts / benchmark_duration_sec)
 
-  total_output_tokens = np.sum([output_len for _, output_len, _ in
-                                request_latencies])
+  total_output_tokens = output_lens.sum()
   output_tokens_per_second = total_output_tokens / benchmark_duration_sec
   benchmark_result['throughput'] = output_tokens_per_second
 
   print(f"Output_tokens/sec: {output_tokens_per_second:.2f}")
   benchmark_result['total_output_token'] = int(total_output_tokens)
 
-  total_input_tokens = np.sum([prompt_len for prompt_len, _, _ in
-                               request_latencies])
+  total_input_tokens = prompt_lens.sum()
   input_tokens_per_sec = total_input_tokens / benchmark_duration_sec
   print(f"Input_tokens/sec: {input_tokens_per_sec:.2f}")
   benchmark_result['total_input_tokens'] = int(total_input_tokens)
@@ -852,41 +1222,104 @@ async def print_and_save_result(args: argparse.Namespace, benchmark_duration_sec
   print(f"Tokens/sec: {tokens_per_sec:.2f}")
   benchmark_result['total_tokens'] = int(total_tokens)
   benchmark_result['tokens_per_sec'] = tokens_per_sec
-  ttft_stats = {}
-  itls_stats = {}
-  tpot_stats = {}
-  if args.stream_request:
-    ttft_stats = get_stats_for_set("TTFT_ms", "Time to First Token (ms)", ttfts)
-    itls_stats = get_stats_for_set("ITL_ms", "Inter-Token Latency (ms)", itls)
-    tpot_stats = get_stats_for_set("TPOT_ms", "Time Per Output Token (ms)", tpots)
   if args.machine_cost:
     print(
         "Cost $/1k tokens:"
         f" {args.machine_cost * 1000 / output_tokens_per_second}"
     )
 
-  benchmark_result = {
-    **benchmark_result,
-    **(get_stats_for_set("per_token_latency_ms", "milliseconds/token (includes waiting time on server)", [
-      latency / (prompt_len + output_len)
-      for prompt_len, output_len, latency in request_latencies
-    ])),
-    **ttft_stats,
-    **itls_stats,
+  if numexpr is not None:
+    # Evaluates the whole expression in cache-sized blocks, without
+    # materializing prompt_lens + output_lens.
+    per_token_latencies = numexpr.evaluate("latencies / (prompt_lens + output_lens)")
+  else:
+    per_token_latencies = latencies / (prompt_lens + output_lens)
+
+  # Requests which returned no tokens have no time per output token.
+  has_output = output_lens > 0
+  normalized_tpots = latencies[has_output] / output_lens[has_output]
+
+  # (name, description, points, integer) of each set to compute stats for.
+  stat_sets = []
+  if args.stream_request:
+    stat_sets += [
+      ("TTFT_ms", "Time to First Token (ms)", ttfts, False),
+      ("ITL_ms", "Inter-Token Latency (ms)", itls, False),
+      ("TPOT_ms", "Time Per Output Token (ms)", tpots, False),
+    ]
+  stat_sets += [
+    ("per_token_latency_ms", "milliseconds/token (includes waiting time on server)", per_token_latencies, False),
     # NOTE: The latency below includes requests awaiting time on server side.
     # It's not comparable with the model inference latency for batch size 1.
-    **(get_stats_for_set("latency_ms", "milliseconds/request (includes waiting time on server)" ,[latency for _, _, latency in request_latencies])),
-    **(get_stats_for_set("normalized_time_per_output_token_ms", "milliseconds/output_token (includes waiting time on server)", [latency / output_len for _, output_len, latency in request_latencies])),
-    **(get_stats_for_set("input_len", "input length", [float(prompt_len) for prompt_len, _, _ in request_latencies])),
-    **(get_stats_for_set("output_len", "output length", [float(output_len) for _, output_len, _ in request_latencies]))
+    ("latency_ms", "milliseconds/request (includes waiting time on server)", latencies, False),
+    ("normalized_time_per_output_token_ms", "milliseconds/output_token (includes waiting time on server)", normalized_tpots, False),
+    ("input_len", "input length", prompt_lens, True),
+    ("output_len", "output length", output_lens, True),
+  ]
+  # The sets are independent and numpy releases the GIL while partitioning
+  # and reducing them, so their stats are computed concurrently.
+  with ThreadPoolExecutor(max_workers=4) as executor:
+    futures = {
+      name: executor.submit(get_stats_for_set, name, points, integer)
+      for name, _, points, integer in stat_sets
+    }
+  stats = {name: future.result() for name, future in futures.items()}
+  for name, description, _, _ in stat_sets:
+    print(f"Average {description}:" f" {stats[name][f'avg_{name}']:.2f}")
+
+  benchmark_result = {
+    **benchmark_result,
+    **stats["per_token_latency_ms"],
+    **stats.get("TTFT_ms", {}),
+    **stats.get("ITL_ms", {}),
+    **stats["latency_ms"],
+    **stats["normalized_time_per_output_token_ms"],
+    **stats["input_len"],
+    **stats["output_len"],
   }
 
   server_metrics = {}
   if args.scrape_server_metrics:
-    server_metrics = print_metrics(metrics_to_scrape(args.backend), benchmark_duration_sec, args.pm_namespace, args.pm_job)
+    server_metrics = await print_metrics(metrics_to_scrape(args.backend), benchmark_duration_sec, args.pm_namespace, args.pm_job, args.tcp_conn_limit)
   if args.save_json_results:
     save_json_results(args, benchmark_result, server_metrics, model, errors)
 
+def init_gcs(args: argparse.Namespace):
+  # Create GCS client before benchmarking
+  # Should fail fast if client is misconfigured or missing permissions
+  if args.output_bucket is not None:
+    global gcs_client
+    gcs_client = storage.Client()
+    global gcs_bucket
+    gcs_bucket = gcs_client.bucket(args.output_bucket)
+
+    if args.output_bucket_filepath:
+      blob = gcs_bucket.blob(args.output_bucket_filepath)
+      # Only creates the blob if it doesn't exist yet, in one request.
+      try:
+        blob.upload_from_string('', if_generation_match=0)
+      except google.cloud.exceptions.PreconditionFailed:
+        pass
+
+def load_tokenizer(
+    name_or_path: str, trust_remote_code: bool
+) -> PreTrainedTokenizerBase:
+  """Loads the tokenizer, directly from a bare local tokenizer.json if possible."""
+  tokenizer_file = os.path.join(name_or_path, "tokenizer.json")
+  tokenizer_config_file = os.path.join(name_or_path, "tokenizer_config.json")
+  if (not trust_remote_code and os.path.isfile(tokenizer_file)
+      and not os.path.exists(tokenizer_config_file)):
+    # Skips resolving the model config and tokenizer class, which
+    # AutoTokenizer redoes on every run even for a local directory. Only done
+    # without a tokenizer_config.json, whose special tokens and settings such
+    # as add_bos_token would be ignored and change the token counts.
+    return PreTrainedTokenizerFast(
+        tokenizer_file=tokenizer_file, name_or_path=name_or_path
+    )
+  return AutoTokenizer.from_pretrained(
+      name_or_path, trust_remote_code=trust_remote_code
+  )
+
 async def main(args: argparse.Namespace):
   print(args)
   models = args.models.split(',')
@@ -895,7 +1328,6 @@ async def main(args: argparse.Namespace):
     print(f"Traffic split: {args.traffic_split}")
   else:
     print("No traffic split specified. Defaulting to uniform traffic split.")
-  random.seed(args.seed)
   np.random.seed(args.seed)
   endpoint = (
     "v1/completions"
@@ -903,26 +1335,21 @@ async def main(args: argparse.Namespace):
     else args.endpoint
 )
   
-  # Create GCS client before benchmarking
-  # Should fail fast if client is misconfigured or missing permissions
-  if args.output_bucket is not None:
-    global gcs_client
-    gcs_client = storage.Client()
-    global gcs_bucket
-    gcs_bucket = gcs_client.bucket(args.output_bucket)
-
-    if args.output_bucket_filepath:
-      blob = gcs_bucket.blob(args.output_bucket_filepath)
-      if not blob.exists():
-        blob.upload_from_string('')
+  # Create GCS client and load the tokenizer in the background while the
+  # Prometheus server starts, as neither depends on the other. The tasks are
+  # scheduled now, so their threads start before start_http_server blocks.
+  gcs_task = asyncio.create_task(asyncio.to_thread(init_gcs, args))
+  tokenizer_task = asyncio.create_task(asyncio.to_thread(
+      load_tokenizer, args.tokenizer, args.trust_remote_code
+  ))
+  # Let the tasks run up to submitting their work to the thread pool.
+  await asyncio.sleep(0)
 
   print(f"Starting Prometheus Server on port {PROMETHEUS_PORT}")
   start_http_server(PROMETHEUS_PORT)
 
   api_url = f"http://{args.host}:{args.port}/{endpoint}"
-  tokenizer = AutoTokenizer.from_pretrained(
-      args.tokenizer, trust_remote_code=args.trust_remote_code
-  )
+  _, tokenizer = await asyncio.gather(gcs_task, tokenizer_task)
 
   benchmark_start_time = time.time()
   args.start_datetime = datetime.fromtimestamp(benchmark_start_time)
@@ -940,6 +1367,12 @@ def parse_traffic_split(arg):
             "Traffic split must be a comma-separated list of floats, e.g. '0.9,0.1'"
         )
 
+def non_negative_int(arg):
+    value = int(arg)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"Must be a non-negative integer, got {value}")
+    return value
+
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(
       description="Benchmark the online serving throughput."
@@ -1074,6 +1507,15 @@ if __name__ == "__main__":
           " and max_output_length."
       ),
   )
+  parser.add_argument(
+      "--dataset-cache",
+      action=argparse.BooleanOptionalAction,
+      default=True,
+      help=(
+          "Whether to cache the token counts of the filtered dataset next to"
+          " the dataset file, to skip tokenizing it on later runs."
+      ),
+  )
   parser.add_argument(
       "--save-json-results",
       action="store_true",
@@ -1121,13 +1563,46 @@ if __name__ == "__main__":
   parser.add_argument("--pm-namespace", type=str, default="default", help="namespace of the pod monitoring object, ignored if scrape-server-metrics is false")
   parser.add_argument("--pm-job", type=str, default="vllm-podmonitoring", help="name of the pod monitoring object, ignored if scrape-server-metrics is false")
   parser.add_argument("--tcp-conn-limit", type=int, default=100, help="Max number of tcp connections allowed per aiohttp ClientSession")
+  parser.add_argument(
+      "--max-retries",
+      type=non_negative_int,
+      default=0,
+      help=(
+          "Maximum number of times a non-streamed request is re-sent when the"
+          " server responds with an error. Requests still failing are counted"
+          " as ServerError. The latency of a retried request includes its"
+          " failed attempts but not the backoff between them."
+      ),
+  )
+  parser.add_argument(
+      "--use-uvloop",
+      action=argparse.BooleanOptionalAction,
+      default=sys.platform == "linux",
+      help="Whether to run the benchmark on the uvloop event loop. Defaults to true on Linux.",
+  )
+  parser.add_argument(
+      "--trace-requests",
+      action="store_true",
+      help="Whether to update the Prometheus request count metric as requests are sent.",
+  )
   cmd_args = parser.parse_args()
   
   level = logging.INFO
-  logger = logging.getLogger(__name__)
   logger.setLevel(level)
   handler = logging.StreamHandler()  # This sends output to the console
   handler.setLevel(level) # Set handler level
   logger.addHandler(handler)
+
+  run = asyncio.run
+  if cmd_args.use_uvloop:
+    try:
+      import uvloop
+      if hasattr(uvloop, "run"):
+        run = uvloop.run
+      else:
+        # uvloop releases before 0.18 have no uvloop.run.
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+      logger.warning("uvloop is not installed, using the default asyncio event loop")
   
-  asyncio.run(main(cmd_args))
\ No newline at end of file
+  run(main(cmd_args))
\ No newline at end of file